@@ -3,11 +3,11 @@
 A python client library for the Exasol database using the asyncio framework
 
 """
-from .common import ExaConnStatus
+from .common import ExaConnStatus, install_uvloop
 from .connection import (
     Connection, ExaError, ExaProtocolError, ExaServerError)
 from .result import ResultType
 
 __all__ = [
     'Connection', 'ExaConnStatus', 'ExaError', 'ExaProtocolError',
-    'ExaServerError', 'ResultType']
+    'ExaServerError', 'ResultType', 'install_uvloop']
@@ -1,5 +1,6 @@
 """ Common functionality for exasyncio """
 
+from asyncio import set_event_loop_policy
 from enum import IntEnum
 from types import TracebackType
 from typing import (
@@ -19,6 +20,7 @@ class ExaConnStatus(IntEnum):
 
 class AsyncContextMixin:
     """ Mixin to provide asynchronous context support """
+    __slots__ = ()
 
     async def __aenter__(self):
         return self
@@ -30,3 +32,20 @@ class AsyncContextMixin:
             exc_tb: Optional[TracebackType],
             ) -> None:
         await self.close()
+
+
+def install_uvloop():
+    """ Installs uvloop as the event loop implementation. uvloop is faster
+    than the default asyncio event loop and is recommended for exasyncio.
+
+    Call this before the event loop is created, e.g. before asyncio.run.
+    Raises ImportError when uvloop is not installed.
+
+    This sets the event loop policy, which is deprecated as of Python 3.14.
+    There, use uvloop.run(main()) or
+    asyncio.Runner(loop_factory=uvloop.new_event_loop) instead.
+
+    """
+    # pylint: disable-next=import-outside-toplevel
+    import uvloop
+    set_event_loop_policy(uvloop.EventLoopPolicy())
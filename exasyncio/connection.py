@@ -3,8 +3,9 @@
 Manage a connection to an Exacol database
 
 """
-from asyncio import Lock, get_running_loop, wait_for
+from asyncio import Lock, get_running_loop, shield, wait_for
 import base64
+from functools import lru_cache
 import getpass
 import json
 import os
@@ -19,11 +20,41 @@ except ImportError:
 import aiohttp
 import rsa
 
+try:
+    from orjson import dumps as _dumps_bytes, loads as _loads
+
+    def _dumps_str(obj):
+        return _dumps_bytes(obj).decode()
+except ImportError:
+    _dumps_str = json.dumps
+    _loads = json.loads
+
+    def _dumps_bytes(obj):
+        return json.dumps(obj).encode()
+
 from exasyncio.common import ExaConnStatus, AsyncContextMixin
-from exasyncio.result import Result
+from exasyncio.result import ISO_DATETIME_FORMATS, Result
+
 
-# Exasol reports timezones in uppercase. Mapping to retrieve original name
-_upper_zones = {z.upper(): z for z in zoneinfo.available_timezones()}
+@lru_cache(maxsize=None)
+def _get_login_template():
+    # Static part of the login request. Built once, in a thread on first
+    # login, as platform.platform() may run a subprocess.
+    return {
+        'driverName': 'exasyncio 0.1',
+        'clientName': 'exasyncio',
+        'clientVersion': '0.1',
+        'clientOs': platform.platform(),
+        'clientOsUsername': getpass.getuser(),
+        'clientRuntime': f'Python {platform.python_version()}',
+    }
+
+
+@lru_cache(maxsize=None)
+def _get_upper_zones():
+    # Exasol reports timezones in uppercase. Mapping to retrieve original name.
+    # Built on first use, as it requires scanning the time zone database.
+    return {z.upper(): z for z in zoneinfo.available_timezones()}
 
 
 class ExaError(Exception):
@@ -57,11 +88,24 @@ def _from_arg_or_env(name, val, default=None):
 class Connection(AsyncContextMixin):
     """ Represents an Exasol database connection using the websockets protocol.
 
+    When use_compression is enabled, messages are compressed with zlib, which
+    is the only compression the Exasol websocket protocol supports. The
+    compression_level applies to messages sent to the server. It ranges from
+    -1 to 9, where None or -1 means the zlib default.
+
+    Result data is fetched in chunks of about 5 MB. The read_bufsize and
+    max_msg_size arguments set the websocket read buffer size and maximum
+    message size, which must be large enough to receive these chunks.
+
+    Using uvloop as event loop is recommended, see install_uvloop.
+
     """
     def __init__(
             self, host=None, port=None, user=None, password=None,
             schema='', autocommit=True, query_timeout=0,
-            snapshot_transactions=None, use_compression=True):
+            snapshot_transactions=None, use_compression=True,
+            compression_level=1, read_bufsize=8 * 1024 * 1024,
+            max_msg_size=16 * 1024 * 1024):
 
         host = _from_arg_or_env("HOST", host)
         if host is None:
@@ -80,15 +124,27 @@ class Connection(AsyncContextMixin):
         self.snapshot_transactions = snapshot_transactions
         self._status = ExaConnStatus.CLOSED
         self.date_format = None
+        self._can_parse_date = False
         self.datetime_format = None
+        self._can_parse_datetime = False
         self._use_compression = use_compression
+        if compression_level is None:
+            compression_level = zlib.Z_DEFAULT_COMPRESSION
+        elif compression_level not in range(-1, 10):
+            raise ValueError("Invalid compression level")
+        self._compression_level = compression_level
+        self._read_bufsize = read_bufsize
+        self._max_msg_size = max_msg_size
         self._tz = None
         self._ws = None
-        self._req_lock = Lock()
+        self._req_lock = None
         self._session = None
         self._ws = None
         self._loop = None
+        self._pending_close_handles = []
+        self._close_task = None
         self._recv_msg = self._recv_msg_uncompressed
+        self._encode_msg = self._encode_msg_uncompressed
         self._send_msg = self._send_msg_uncompressed
 
     @property
@@ -105,8 +161,12 @@ class Connection(AsyncContextMixin):
         if self._status is not ExaConnStatus.CLOSED:
             raise ValueError("Connection is already connected")
 
-        self._session = aiohttp.ClientSession()
-        self._ws = await self._session.ws_connect(self.uri)
+        # Created here, so it belongs to the running event loop
+        self._req_lock = Lock()
+
+        self._session = aiohttp.ClientSession(read_bufsize=self._read_bufsize)
+        self._ws = await self._session.ws_connect(
+            self.uri, max_msg_size=self._max_msg_size)
         # self.ws = await ws_connect(self.uri)
         self._status = ExaConnStatus.WS_CONNECTED
 
@@ -116,23 +176,30 @@ class Connection(AsyncContextMixin):
 
     async def _recv_msg_compressed(self):
         data = await self._recv_msg_uncompressed()
-        return zlib.decompress(data).decode()
+        return zlib.decompress(data)
 
     async def _recv(self):
         data = await self._recv_msg()
         try:
-            data = json.loads(data)
+            data = _loads(data)
         except BaseException as ex:
             raise ExaProtocolError("Invalid json") from ex
 
         attrs = data.get("attributes")
         if attrs is not None:
-            self.date_format = attrs.get("dateFormat", self.date_format)
-            self.datetime_format = attrs.get(
-                "datetimeFormat", self.datetime_format)
+            date_format = attrs.get("dateFormat")
+            if date_format is not None:
+                self.date_format = date_format
+                self._can_parse_date = date_format == 'YYYY-MM-DD'
+            datetime_format = attrs.get("datetimeFormat")
+            if datetime_format is not None:
+                self.datetime_format = datetime_format
+                # determined once here instead of for every result
+                self._can_parse_datetime = (
+                    datetime_format in ISO_DATETIME_FORMATS)
             tz_name = attrs.get("timezone")
             if tz_name is not None:
-                tz_name = _upper_zones.get(tz_name)
+                tz_name = _get_upper_zones().get(tz_name)
                 if tz_name is None:
                     self._tz = None
                 else:
@@ -156,15 +223,25 @@ class Connection(AsyncContextMixin):
             raise ExaServerError(sql_code, text)
         raise ExaProtocolError("Invalid status")
 
-    async def _send_msg_compressed(self, data):
-        await self._ws.send_bytes(zlib.compress(data.encode(), 1))
+    def _encode_msg_compressed(self, data):
+        return zlib.compress(_dumps_bytes(data), self._compression_level)
+
+    @staticmethod
+    def _encode_msg_uncompressed(data):
+        return _dumps_str(data)
+
+    async def _send_msg_compressed(self, msg):
+        await self._ws.send_bytes(msg)
 
-    async def _send_msg_uncompressed(self, data):
-        await self._ws.send_str(data)
+    async def _send_msg_uncompressed(self, msg):
+        await self._ws.send_str(msg)
 
     async def _request(self, data):
+        # Encoding does not depend on the connection state, so do it before
+        # taking the lock. Only the exchange itself needs to be serialized.
+        msg = self._encode_msg(data)
         async with self._req_lock:
-            await self._send_msg(json.dumps(data))
+            await self._send_msg(msg)
             return await self._recv()
 
     def _encrypt_password(self, public_key_pem):
@@ -174,23 +251,25 @@ class Connection(AsyncContextMixin):
     async def _login(self):
 
         resp = await self._request({'command': 'login', 'protocolVersion': 3})
-        password = self._encrypt_password(resp['responseData']['publicKeyPem'])
+        # rsa is pure Python, encrypt in a thread to keep the event loop going
+        password = await self._loop.run_in_executor(
+            None, self._encrypt_password,
+            resp['responseData']['publicKeyPem'])
+        login_template = await self._loop.run_in_executor(
+            None, _get_login_template)
         resp = await self._request({
+            **login_template,
             'username': self.user,
             'password': password,
-            'driverName': 'exasyncio 0.1',
-            'clientName': 'exasyncio',
-            'clientVersion': '0.1',
-            'clientOs': platform.platform(),
-            'clientOsUsername': getpass.getuser(),
-            'clientRuntime': f'Python {platform.python_version()}',
             'useCompression': self._use_compression,
             'attributes': self._get_login_attributes()
         })
         if self._use_compression:
             self._recv_msg = self._recv_msg_compressed
+            self._encode_msg = self._encode_msg_compressed
             self._send_msg = self._send_msg_compressed
         self.date_format = 'YYYY-MM-DD'
+        self._can_parse_date = True
         self._status = ExaConnStatus.CONNECTED
 
     def _get_login_attributes(self):
@@ -224,13 +303,19 @@ class Connection(AsyncContextMixin):
 
         return _await().__await__()
 
-    async def execute(self, query, raw=False):
-        """ Executes a query and returns the result """
+    async def execute(self, query, raw=False, prefetch=True):
+        """ Executes a query and returns the result
+
+        Large results are fetched in chunks. With prefetch enabled, the next
+        chunk is fetched while the current one is consumed, at the cost of
+        holding two chunks in memory.
+
+        """
         resp = await self._request({
             'command': 'execute',
             'sqlText': query,
         })
-        return Result(self, resp["responseData"], raw)
+        return Result(self, resp["responseData"], raw, prefetch)
 
     async def _fetch(self, handle, offset):
         return await self._request({
@@ -240,8 +325,46 @@ class Connection(AsyncContextMixin):
             'numBytes': 5242880,  # 5 MB
         })
 
+    def _schedule_close_result(self, handle):
+        # Handles are collected and closed with a single request on the next
+        # iteration of the event loop. Returns the task closing the handle.
+        self._pending_close_handles.append(handle)
+        if self._close_task is None:
+            self._close_task = self._loop.create_task(
+                self._close_pending_results())
+        return self._close_task
+
+    async def _close_pending_results(self):
+        # Returns the exceptions of the handles that failed to close, by
+        # handle. It does not raise itself, because nobody awaits the handles
+        # scheduled from Result.__del__.
+        handles = self._pending_close_handles
+        self._pending_close_handles = []
+        self._close_task = None
+        try:
+            await self._close_results(handles)
+        except Exception as ex:  # pylint: disable=broad-except
+            if len(handles) == 1:
+                return {handles[0]: ex}
+        else:
+            return {}
+
+        # A single failing handle fails the whole batch. Close the handles one
+        # by one, so each result gets its own outcome.
+        errors = {}
+        for handle in handles:
+            try:
+                await self._close_results([handle])
+            except Exception as ex:  # pylint: disable=broad-except
+                errors[handle] = ex
+        return errors
+
     async def _close_result(self, handle):
-        await self._close_results([handle])
+        # shield, because the close task is shared with other results
+        errors = await shield(self._schedule_close_result(handle))
+        error = errors.get(handle)
+        if error is not None:
+            raise error
 
     async def _close_results(self, handles):
         if self._status is ExaConnStatus.CONNECTED:
@@ -3,19 +3,35 @@
 Manage the results of executed Exasol queries
 
 """
-from asyncio import run_coroutine_threadsafe
+from asyncio import create_task, shield
+from contextlib import suppress
 from datetime import date, datetime
 from decimal import Decimal
 from enum import Enum
-from functools import cached_property
-import re
 
 from uuid import UUID
 
 from exasyncio.common import ExaConnStatus, AsyncContextMixin
 
-datetime_pattern = re.compile(
-    r"YYYY-MM-DD(( |T)HH(24)?(:MI(:SS(\.FF(3|6))?)?)?)?")
+try:
+    # ciso8601 parses timestamps considerably faster
+    from ciso8601 import parse_datetime as _parse_datetime
+except ImportError:
+    _parse_datetime = datetime.fromisoformat
+
+# The datetime formats that can be parsed as ISO 8601
+ISO_DATETIME_FORMATS = frozenset(["YYYY-MM-DD"] + [
+    f"YYYY-MM-DD{sep}{hour}{rest}"
+    for sep in (" ", "T")
+    for hour in ("HH", "HH24")
+    for rest in ("", ":MI", ":MI:SS", ":MI:SS.FF3", ":MI:SS.FF6")])
+
+
+# Data types that never need a converter, because the values are already
+# converted by the JSON protocol, or are not converted at all
+_UNCONVERTED_TYPES = frozenset({
+    "BOOLEAN", "CHAR", "DOUBLE", "GEOMETRY", "INTERVAL DAY TO SECOND",
+    "INTERVAL YEAR TO MONTH", "VARCHAR"})
 
 
 class ResultType(Enum):
@@ -44,46 +60,67 @@ def _get_bytes_or_uuid(val):
     return bytes.fromhex(val)
 
 
+def _select_hashtype_converter(values):
+    """ Selects the converter for the values of a 16 byte HASHTYPE column """
+
+    # Whether the values are UUIDs depends on the HASHTYPE_FORMAT, which is
+    # the same for all values of a result. So the first value is decisive.
+    for val in values:
+        if val is not None:
+            return UUID if len(val) == 36 else bytes.fromhex
+    return _get_bytes_or_uuid
+
+
 def _get_hashtype_converter(col_data):
     if col_data["size"] == 32:
         return _get_bytes_or_uuid
     return bytes.fromhex
 
 
+class _EmptyAsyncIterator:
+    """ Async iterator without any items. Stateless, so a single instance is
+    shared. """
+    __slots__ = ()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raise StopAsyncIteration
+
+
+_EMPTY_AITER = _EmptyAsyncIterator()
+
+
 class ResultConverter:
     """ Helper class to convert column data """
 
     def __init__(self, result):
         conn = result.connection
         self.tzinfo = conn._tz
-        self.datetime_format = conn.datetime_format
-        self.date_format = conn.date_format
+        # Indicate if the date and datetime formats are ok for parsing
+        self.can_parse_date = conn._can_parse_date
+        self.can_parse_datetime = conn._can_parse_datetime
         self.columns = result.columns
 
     # pylint: disable-next=unused-argument
     def get_date_converter(self, col_data):  # noqa
         """ Returns converter funtion for date values """
-        if self.date_format == 'YYYY-MM-DD':
+        if self.can_parse_date:
             return date.fromisoformat
         return None
 
-    @cached_property
-    def can_parse_datetime(self):
-        """ Indicates if the datetime format is ok for datetime.fromisoformat
-        """
-        return bool(datetime_pattern.fullmatch(self.datetime_format))
-
     # pylint: disable-next=unused-argument
     def get_timestamp_converter(self, col_data):  # noqa
         """ Returns converter function for timestamp values """
         if self.can_parse_datetime:
-            return datetime.fromisoformat
+            return _parse_datetime
         return None
 
     def get_datetime_tz(self, val):
         """ Converter for datetimes with time zone """
 
-        return datetime.fromisoformat(val).replace(tzinfo=self.tzinfo)
+        return _parse_datetime(val).replace(tzinfo=self.tzinfo)
 
     # pylint: disable-next=unused-argument
     def get_timestamptz_converter(self, col_data):  # noqa
@@ -91,12 +128,17 @@ class ResultConverter:
         if self.can_parse_datetime:
             if self.tzinfo:
                 return self.get_datetime_tz
-            return datetime.fromisoformat
+            return _parse_datetime
         return None
 
     def get_transform(self):
         """ Returns the function to use for transforming the column data """
 
+        col_types = [col["dataType"] for col in self.columns]
+        if all(col["type"] in _UNCONVERTED_TYPES for col in col_types):
+            # nothing to convert, shortcut to zip
+            return zip
+
         # Getting a converter for a column is a two step process. First a
         # converter_getter is retrieved for the data type name.
         # The converter_getter is responsible for returning the actual
@@ -108,7 +150,6 @@ class ResultConverter:
             "TIMESTAMP WITH LOCAL TIME ZONE": self.get_timestamptz_converter,
             "HASHTYPE": _get_hashtype_converter,
         }
-        col_types = [col["dataType"] for col in self.columns]
         converter_getters = (
             type_conv_getters.get(col_type["type"]) for col_type in col_types)
         converters = [
@@ -119,38 +160,122 @@ class ResultConverter:
             # no converters present, shortcut to zip
             return zip
 
+        # The converters of 16 byte HASHTYPE columns are replaced by a more
+        # specific one, based on the first chunk of data
+        hashtype_cols = [
+            i for i, conv in enumerate(converters)
+            if conv is _get_bytes_or_uuid]
+
         def transform_rows(*data):
-            # uses the earlier retrieved converters to transform each row
-            return (
-                tuple(
-                    val if conv is None else conv(val)
-                    for conv, val in zip(converters, row))
-                for row in zip(*data)
-            )
+            while hashtype_cols:
+                i = hashtype_cols.pop()
+                converters[i] = _select_hashtype_converter(data[i])
+
+            # Uses the earlier retrieved converters to transform the columns.
+            # Mapping a converter over a whole column selects it once per
+            # column instead of once per value, and zip builds the rows
+            # without running Python code for every value.
+            return zip(*(
+                col if conv is None else map(conv, col)
+                for conv, col in zip(converters, data)))
 
         return transform_rows
 
+    def _get_arrow_type(self, pa, col_type):
+        # Returns the pyarrow type for a column and whether the values are
+        # strings that must be cast to that type
+        type_name = col_type["type"]
+        if type_name == "DECIMAL":
+            if col_type["scale"] == 0 and col_type["precision"] < 19:
+                return pa.int64(), False
+            return pa.decimal128(
+                col_type["precision"], col_type["scale"]), True
+        if type_name == "DOUBLE":
+            return pa.float64(), False
+        if type_name == "BOOLEAN":
+            return pa.bool_(), False
+        if type_name == "DATE" and self.can_parse_date:
+            return pa.date32(), True
+        if type_name == "TIMESTAMP" and self.can_parse_datetime:
+            return pa.timestamp('us'), True
+        if (type_name == "TIMESTAMP WITH LOCAL TIME ZONE" and
+                self.can_parse_datetime):
+            return pa.timestamp('us', self.tzinfo and str(self.tzinfo)), True
+        return pa.string(), False
+
+    def get_arrow_transform(self):
+        """ Returns the function to use for transforming the column data into
+        a pyarrow RecordBatch, and the schema of the batches
+
+        """
+        # pylint: disable-next=import-outside-toplevel
+        import pyarrow as pa
+        # pylint: disable-next=import-outside-toplevel
+        from pyarrow import compute as pc
+
+        col_types = [
+            self._get_arrow_type(pa, col["dataType"]) for col in self.columns]
+        schema = pa.schema([
+            (col["name"], arrow_type)
+            for col, (arrow_type, _) in zip(self.columns, col_types)])
+
+        def to_array(values, arrow_type, cast):
+            if not cast:
+                return pa.array(values, arrow_type)
+            # parse the whole column at once instead of value by value
+            arr = pa.array(values, pa.string())
+            if pa.types.is_timestamp(arrow_type) and arrow_type.tz:
+                # values are local times in the session time zone, resolve
+                # DST transitions like datetime does with fold=0
+                return pc.assume_timezone(
+                    arr.cast(pa.timestamp(arrow_type.unit)), arrow_type.tz,
+                    ambiguous='earliest', nonexistent='earliest')
+            return arr.cast(arrow_type)
+
+        def transform_batch(*data):
+            return pa.RecordBatch.from_arrays(
+                [to_array(values, *col_type)
+                 for values, col_type in zip(data, col_types)],
+                schema=schema)
+
+        return transform_batch, schema
+
 
 class Result(AsyncContextMixin):
     """ Represents the result of a query. Instantiated by Connection.execute.
 
     """
-    def __init__(self, cn, data, raw):
+    __slots__ = (
+        '_cn', '_prefetch', '_exhausted', '_fetch_task', 'result_type',
+        '_columns', '_data', '_result_handle', 'rowcount',
+        '_result_converter', '_transform', '_rows', '_num_rows',
+        '__weakref__')
+
+    def __init__(self, cn, data, raw, prefetch=True):
         self._cn = cn
-        self._aiterator = None
+        self._prefetch = prefetch
+        self._exhausted = False
+        # rows of the current chunk
+        self._rows = iter(())
+        # number of rows fetched from the server so far
+        self._num_rows = 0
+        self._fetch_task = None
         result_data = data["results"][0]
         self.result_type = ResultType(result_data["resultType"])
         if self.result_type is ResultType.RESULTSET:
-            self._result_set = result_data['resultSet']
             result_data = result_data['resultSet']
+            self._columns = result_data["columns"]
             self._data = result_data.get("data")
             self._result_handle = result_data.get("resultSetHandle")
             self.rowcount = result_data["numRows"]
             if raw:
                 self._result_converter = None
+                self._transform = zip
             else:
                 self._result_converter = ResultConverter(self)
+                self._transform = self._result_converter.get_transform()
         else:
+            self._columns = None
             self._data = None
             self._result_handle = None
 
@@ -158,60 +283,181 @@ class Result(AsyncContextMixin):
     def connection(self):
         return self._cn
 
-    @cached_property
+    @property
     def columns(self):
-        if self.result_type is ResultType.RESULTSET:
-            return self._result_set["columns"]
+        return self._columns
+
+    async def _fetch_chunk(self):
+        # returns the next chunk of column lists, fetched from the server, or
+        # None when the result got closed in the meantime
+        handle = self._result_handle
+        fetch_task = self._fetch_task
+        if fetch_task is None:
+            # pylint: disable-next=protected-access
+            fetch_task = self._fetch_task = create_task(
+                self.connection._fetch(handle, self._num_rows))
+        # Shielded, because cancelling a fetch after it is sent would leave
+        # the response unread. Close waits for it instead.
+        resp_data = (await shield(fetch_task))["responseData"]
+        if self._exhausted:
+            # closed while fetching, close has taken care of the fetch task
+            return None
+        if self._fetch_task is not fetch_task:
+            # Another task awaited the same fetch and took the chunk
+            raise RuntimeError("Result is already fetched by another task")
+        self._fetch_task = None
+        self._num_rows += resp_data["numRows"]
+        if self._prefetch and self._num_rows < self.rowcount:
+            # fetch the next chunk, while the current one is consumed
+            # pylint: disable-next=protected-access
+            self._fetch_task = create_task(
+                self.connection._fetch(handle, self._num_rows))
+        return resp_data["data"]
+
+    async def _next_chunk(self):
+        # Returns the next chunk of column lists, or None when there are no
+        # more. The fetch position is kept on the instance instead of in a
+        # generator, so a Result does not reference itself and gets deleted
+        # (and its handle closed) as soon as it is no longer used.
+        if not self._exhausted:
+            if self._result_handle is not None:
+                if self._num_rows < self.rowcount:
+                    data = await self._fetch_chunk()
+                    if data is not None:
+                        return data
+            elif self._data is not None:
+                # the data already present in the execute response
+                data, self._data = self._data, None
+                return data
+        # fully iterated over result so close immediately
+        await self.close()
         return None
 
-    async def _aiterate(self):
+    async def _iter_chunks(self):
+        data = await self._next_chunk()
+        while data is not None:
+            yield data
+            data = await self._next_chunk()
+
+    def _check_result_set(self):
         if self.result_type is not ResultType.RESULTSET:
             raise ValueError("Result has no data")
 
-        if self._result_converter is None:
-            transform = zip
-        else:
-            transform = self._result_converter.get_transform()
-
-        if self._result_handle is not None:
-            # result(s) not present in data, fetch result data
-            num_rows = 0
-            while num_rows < self.rowcount:
-                # pylint: disable-next=protected-access
-                resp_data = (await self.connection._fetch(
-                    self._result_handle, num_rows))["responseData"]
-                for row in transform(*resp_data["data"]):
-                    yield row
-                num_rows += resp_data["numRows"]
-        elif self._data is not None:
-            # single result, already present in data
-            for row in transform(*self._data):
+    def _check_no_rows_fetched(self):
+        # The remainder of the current chunk is already converted to rows, so
+        # it can not be handed out as columns anymore.
+        if not self._exhausted and (
+                self._num_rows or
+                self._result_handle is None and self._data is None and
+                self.rowcount):
+            raise ValueError("Rows have already been fetched")
+
+    async def _aiterate(self):
+        # remainder of the current chunk
+        for row in self._rows:
+            yield row
+            if self._exhausted:
+                # closed while iterating
+                return
+
+        transform = self._transform
+        async for data in self._iter_chunks():
+            self._rows = transform(*data)
+            for row in self._rows:
                 yield row
-        # fully iterated over result so close immediately
-        await self.close()
+                if self._exhausted:
+                    return
 
     def __aiter__(self):
         # Iterating is a single forward only operation. Iterating a second time
         # over the result will not yield any rows.
 
-        if self._aiterator is None:
-            self._aiterator = self._aiterate()
-        return self._aiterator
+        self._check_result_set()
+        if self._exhausted:
+            return _EMPTY_AITER
+        return self._aiterate()
 
     async def fetchone(self):
         """ Returns the next row of the result as a tuple if available, else
         None
 
         """
-        async for row in self:
-            return row
+        self._check_result_set()
+        # Step the current chunk directly. Going through the async iterator
+        # would create, and finalize, a generator for every row.
+        row = next(self._rows, None)
+        while row is None:
+            data = await self._next_chunk()
+            if data is None:
+                return None
+            self._rows = self._transform(*data)
+            row = next(self._rows, None)
+        return row
 
     async def fetchall(self):
         """ Returns a list of the remaining rows as tuples """
-        return [row async for row in self]
+        self._check_result_set()
+
+        # Collect the rows a chunk at a time instead of one by one through the
+        # async iterator, starting with the remainder of the current chunk.
+        rows = list(self._rows)
+        transform = self._transform
+        async for data in self._iter_chunks():
+            rows.extend(transform(*data))
+        return rows
+
+    async def fetchall_columns(self):
+        """ Returns the remaining data as a list of columns. Each column is a
+        list of values as received from the server, so without conversion.
+        This avoids building row tuples altogether.
+
+        Raises ValueError when rows have already been fetched.
+
+        """
+        self._check_result_set()
+        self._check_no_rows_fetched()
+
+        columns = None
+        async for data in self._iter_chunks():
+            if columns is None:
+                columns = data
+            else:
+                for column, values in zip(columns, data):
+                    column.extend(values)
+        if columns is None:
+            return [[] for _ in self.columns]
+        return columns
+
+    async def fetch_arrow(self):
+        """ Returns the remaining rows as a pyarrow Table. The column data is
+        converted a column at a time by pyarrow, which is much faster for
+        large results than fetchall.
+
+        Requires pyarrow. Values are converted regardless of the raw argument
+        of execute. Raises ValueError when rows have already been fetched.
+
+        """
+        self._check_result_set()
+        self._check_no_rows_fetched()
+
+        result_converter = self._result_converter or ResultConverter(self)
+        transform, schema = result_converter.get_arrow_transform()
+        batches = [transform(*data) async for data in self._iter_chunks()]
+
+        # pylint: disable-next=import-outside-toplevel
+        import pyarrow as pa
+        return pa.Table.from_batches(batches, schema)
 
     async def close(self):
         """ Closes the result. Can be called multiple times """
+        self._exhausted = True
+        self._rows = iter(())
+        fetch_task = self._fetch_task
+        if fetch_task is not None:
+            # A prefetch is pending, let it finish before closing the handle
+            self._fetch_task = None
+            with suppress(Exception):
+                await fetch_task
         result_handle = self._result_handle
         if result_handle is not None:
             self._result_handle = None
@@ -219,8 +465,6 @@ class Result(AsyncContextMixin):
             await self.connection._close_result(result_handle)
         if self._data is not None:
             self._data = None
-        if self._aiterator is not None:
-            await self._aiterator.aclose()
 
     def __del__(self):
         result_handle = self._result_handle
@@ -233,7 +477,7 @@ class Result(AsyncContextMixin):
             # can not be closed now, because this is a synchronous method and
             # closing a statement is an async operation. The GC might also be
             # running from a different thread.
-            # Therefore use run_coroutine_threadsafe to close the result handle
-            run_coroutine_threadsafe(
-                self.connection._close_result(result_handle),
-                self.connection._loop)
+            # Therefore use call_soon_threadsafe to schedule closing the
+            # result handle, together with any other pending handles.
+            self.connection._loop.call_soon_threadsafe(
+                self.connection._schedule_close_result, result_handle)
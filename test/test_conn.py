@@ -59,6 +59,20 @@ class ConnTestCase(IsolatedAsyncioTestCase):
         self.assertIs(cn.status, ExaConnStatus.CONNECTED)
         await cn.close()
 
+    async def test_compression_level(self):
+        for level in (None, 0, 9):
+            cn = await Connection(
+                exa_host, user=exa_user, password=exa_password,
+                compression_level=level)
+            self.assertIs(cn.status, ExaConnStatus.CONNECTED)
+            await cn.close()
+
+        for level in (-2, 10, 1.5):
+            with self.assertRaises(ValueError):
+                await Connection(
+                    exa_host, user=exa_user, password=exa_password,
+                    compression_level=level)
+
     async def test_close_twice(self):
         async with await Connection(
                 exa_host, user=exa_user, password=exa_password,
@@ -1,6 +1,7 @@
+from asyncio import create_task, gather, sleep
 from datetime import date, datetime
 from decimal import Decimal
-from unittest import IsolatedAsyncioTestCase
+from unittest import IsolatedAsyncioTestCase, skipIf
 from uuid import UUID
 
 try:
@@ -8,7 +9,12 @@ try:
 except ImportError:
     from backports import zoneinfo
 
-from exasyncio import Connection, ResultType
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from exasyncio import Connection, ExaServerError, ResultType
 
 from .test_conn import exa_host, exa_user, exa_password
 
@@ -158,6 +164,10 @@ class ResTestCase(IsolatedAsyncioTestCase):
         self.assertEqual(res.result_type, ResultType.ROWCOUNT)
         with self.assertRaises(ValueError):
             await res.fetchall()
+        with self.assertRaises(ValueError):
+            await res.fetchone()
+        with self.assertRaises(ValueError):
+            res.__aiter__()
 
     async def test_iterate_twice(self):
         res = await self.cn.execute("SELECT 1")
@@ -181,16 +191,155 @@ class ResTestCase(IsolatedAsyncioTestCase):
         self.assertEqual(len(rows), cnt * cnt)
         await res.close()
 
+    async def test_fetch_without_prefetch(self):
+        res = await self.cn.execute(
+            "SELECT * FROM EXA_TIME_ZONES, EXA_TIME_ZONES", prefetch=False)
+        rows = await res.fetchall()
+        self.assertEqual(len(rows), res.rowcount)
+
+    async def test_fetch_close_while_iterating(self):
+        res = await self.cn.execute(
+            "SELECT * FROM EXA_TIME_ZONES, EXA_TIME_ZONES")
+        async for _ in res:
+            break
+        await res.close()
+        res = await self.cn.execute("SELECT 1")
+        self.assertEqual(await res.fetchall(), [(1,)])
+
+    async def test_fetch_close_while_fetching(self):
+        res = await self.cn.execute(
+            "SELECT * FROM EXA_TIME_ZONES, EXA_TIME_ZONES")
+        fetch_task = create_task(res.fetchall())
+        # let the fetch get sent, then close from this task
+        await sleep(0)
+        await res.close()
+        self.assertLess(len(await fetch_task), res.rowcount)
+        self.assertEqual(await res.fetchall(), [])
+        res = await self.cn.execute("SELECT 1")
+        self.assertEqual(await res.fetchall(), [(1,)])
+
+    async def test_fetch_concurrently(self):
+        res = await self.cn.execute(
+            "SELECT * FROM EXA_TIME_ZONES, EXA_TIME_ZONES")
+        with self.assertRaises(RuntimeError):
+            await gather(res.fetchone(), res.fetchone())
+        await res.close()
+        res = await self.cn.execute("SELECT 1")
+        self.assertEqual(await res.fetchall(), [(1,)])
+
+    async def test_fetchall_columns(self):
+        res = await self.cn.execute("SELECT 3, 'hi' UNION ALL SELECT 5, 'ho'")
+        cols = await res.fetchall_columns()
+        self.assertEqual(sorted(zip(*cols)), [(3, 'hi'), (5, 'ho')])
+        self.assertEqual(await res.fetchall_columns(), [[], []])
+
+        res = await self.cn.execute("SELECT 3, 'hi' UNION ALL SELECT 5, 'ho'")
+        await res.fetchone()
+        with self.assertRaises(ValueError):
+            await res.fetchall_columns()
+
+        res = await self.cn.execute(
+            "SELECT * FROM EXA_TIME_ZONES, EXA_TIME_ZONES")
+        await res.fetchone()
+        with self.assertRaises(ValueError):
+            await res.fetchall_columns()
+        await res.close()
+
+        res = await self.cn.execute(
+            "SELECT * FROM EXA_TIME_ZONES, EXA_TIME_ZONES")
+        cols = await res.fetchall_columns()
+        self.assertEqual(len(cols), len(res.columns))
+        self.assertEqual(len(cols[0]), res.rowcount)
+
     async def test_fetch_del(self):
         res = await self.cn.execute(
             "SELECT * FROM EXA_TIME_ZONES, EXA_TIME_ZONES")
         del res
 
+    async def test_close_batched(self):
+        results = [
+            await self.cn.execute(
+                "SELECT * FROM EXA_TIME_ZONES, EXA_TIME_ZONES")
+            for _ in range(3)]
+        handles = [res._result_handle for res in results]
+
+        requests = []
+        request = self.cn._request
+
+        async def record_request(data):
+            requests.append(data)
+            return await request(data)
+
+        self.cn._request = record_request
+        await gather(*(res.close() for res in results))
+        self.assertEqual(requests, [{
+            'command': 'closeResultSet', 'resultSetHandles': handles}])
+
+    async def test_close_batch_failure(self):
+        results = [
+            await self.cn.execute(
+                "SELECT * FROM EXA_TIME_ZONES, EXA_TIME_ZONES")
+            for _ in range(2)]
+
+        requests = []
+        request = self.cn._request
+
+        async def failing_request(data):
+            requests.append(data['resultSetHandles'])
+            if -1 in data['resultSetHandles']:
+                raise ExaServerError('42000', 'invalid result set handle')
+            return await request(data)
+
+        self.cn._request = failing_request
+        outcome = await gather(
+            *(res.close() for res in results), self.cn._close_result(-1),
+            return_exceptions=True)
+        self.assertEqual(outcome[:2], [None, None])
+        self.assertIsInstance(outcome[2], ExaServerError)
+        # the failed batch is retried handle by handle
+        self.assertEqual(len(requests), 4)
+        self.assertEqual(len(requests[0]), 3)
+
     async def test_invalid_iterate(self):
         res = await self.cn.execute("SELECT 1")
         await res.fetchall()
         self.assertEqual([row async for row in res._aiterate()], [])
 
+    @skipIf(pyarrow is None, "pyarrow not installed")
+    async def test_fetch_arrow(self):
+        await self.cn.execute(
+            "ALTER SESSION SET NLS_DATE_FORMAT='YYYY-MM-DD'")
+        await self.cn.execute(
+            "ALTER SESSION SET NLS_TIMESTAMP_FORMAT='YYYY-MM-DD HH:MI:SS.FF6'")
+        res = await self.cn.execute("""
+            SELECT 3, 3.5, 'hi', CAST('2020-05-23' AS DATE),
+                CAST('2020-05-23 14:12:12.345000' AS TIMESTAMP)""")
+        table = await res.fetch_arrow()
+        self.assertEqual(table.num_rows, 1)
+        self.assertEqual(table.to_pylist()[0], dict(zip(table.column_names, [
+            3, Decimal('3.5'), 'hi', date(2020, 5, 23),
+            datetime(2020, 5, 23, 14, 12, 12, 345000)])))
+
+        # ambiguous local time, at the end of DST
+        await self.cn.execute("ALTER SESSION SET TIME_ZONE='Europe/Amsterdam'")
+        res = await self.cn.execute("""
+            SELECT CAST('2020-10-25 02:30:00.000000' AS
+                         TIMESTAMP WITH LOCAL TIME ZONE)""")
+        table = await res.fetch_arrow()
+        dt = datetime(
+            2020, 10, 25, 2, 30, tzinfo=zoneinfo.ZoneInfo('Europe/Amsterdam'))
+        self.assertEqual(table.column(0).to_pylist(), [dt])
+
+        res = await self.cn.execute(
+            "SELECT * FROM EXA_TIME_ZONES, EXA_TIME_ZONES")
+        table = await res.fetch_arrow()
+        self.assertEqual(table.num_rows, res.rowcount)
+
+        res = await self.cn.execute("SELECT 3 UNION ALL SELECT 5")
+        await res.fetchone()
+        with self.assertRaises(ValueError):
+            await res.fetch_arrow()
+
     async def test_close(self):
         res = await self.cn.execute("SELECT 1")
         await res.close()